@@ -1,15 +1,48 @@
 """Scraping tools"""
 
-from functools import partial
-from scraped.util import markdown_of_site, download_site
+import io
+import os
+import time
+import hashlib
+import queue
+import asyncio
+import inspect
+import tarfile
+import threading
+import requests
+from types import FunctionType, BuiltinFunctionType, MethodType, MethodWrapperType
+from typing import (
+    Dict,
+    Union,
+    MutableMapping,
+    KT,
+    VT,
+    TypeVar,
+    Callable,
+    Any,
+    Optional,
+    Literal,
+)
+from functools import partial, wraps
+from operator import methodcaller
+from contextlib import suppress, nullcontext
+from collections import Counter
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-markdown_of_site_depth_3 = partial(markdown_of_site, depth=3)
+from dol import Pipe
+from lkj import print_progress
 
+from scraped.util import (
+    markdown_of_site,
+    download_site,
+    DFLT_CACHE_DIR,
+    DFLT_USER_AGENT,
+    DFLT_REQUEST_TIMEOUT,
+    _SESSION,
+)
 
-import os
-import requests
-from typing import Dict, Union, MutableMapping, KT, VT, TypeVar, Callable, Any
-from functools import partial
+markdown_of_site_depth_3 = partial(markdown_of_site, depth=3)  # backcompat alias
 
 DFLT_STORE_DIR = os.environ.get('DFLT_DOL_DOWNLOAD_DIR', '~/Downloads')
 
@@ -19,6 +52,9 @@ ContentType = TypeVar('ContentType')
 StoreFunc = Callable[[KT, ContentType], None]
 
 
+DFLT_COALESCE_BYTES = 64 * 1024 * 1024
+
+
 def is_not_none(x):
     return x is not None
 
@@ -31,6 +67,9 @@ def acquire_content(
     store: Union[Dirpath, MutableMapping, StoreFunc] = DFLT_STORE_DIR,
     *,
     save_condition: Callable[[Any], bool] = is_not_none,
+    concurrency: int = 16,
+    flush_bytes: Optional[int] = None,
+    dedupe: bool = True,
 ):
     """
     Downloads and stores content from a given set of URIs.
@@ -75,6 +114,39 @@ def acquire_content(
     # acquire_content(lambda filepath: open(filepath, 'rb').read(), uris, store)  # Reads file content +SKIP
     # acquire_content(lambda url: requests.get(url).content, uris, store)  # Fetches URL content +SKIP
 
+    If ``uri_to_content`` is an ``async def uri_to_content(client, uri)`` function
+    (such as ``acquire_content.async_url_to_bytes``), the uris are fetched
+    concurrently (at most ``concurrency`` at a time) over a single shared
+    ``httpx.AsyncClient``, which multiplexes requests over HTTP/2 when the server
+    supports it. This requires ``httpx`` (``pip install httpx[http2]``). It also works
+    where an event loop is already running (e.g. in a notebook), in which case the
+    uris are fetched on a loop of another thread.
+
+    >>> acquire_content(acquire_content.async_url_to_bytes, uris, store)  # doctest: +SKIP
+
+    The (sync) ``uri_to_content`` calls are dispatched over a pool of
+    ``concurrency`` threads, since they are typically IO-bound. Contents are stored
+    in the order of ``uris``, as they come in (use ``concurrency=1`` to fetch them
+    one at a time).
+
+    If ``dedupe`` is True (the default), uris that appear several times are only
+    fetched once (provided the uris are hashable):
+
+    >>> calls = []
+    >>> def logged_upper(uri):
+    ...     calls.append(uri)
+    ...     return uri.upper()
+    >>> acquire_content(logged_upper, {'a': 'x', 'b': 'y', 'c': 'x'}, {})
+    >>> calls
+    ['x', 'y']
+
+    If ``flush_bytes`` is given, writes to the store are coalesced: contents are
+    buffered and handed to the store in batches of (at least) ``flush_bytes`` bytes.
+    The store still gets them one by one, so this only pays off with stores that
+    are better written to in bursts. Buffered contents are stored by the time
+    ``acquire_content`` returns, but are lost if the process is killed before.
+    By default, contents are stored as soon as they come in.
+
     See:
     * [A tiny flexible data acquisition python function](https://medium.com/@thorwhalen1/a-tiny-flexible-data-acquisition-python-function-518289dcd1e6) and 
     * [gist](https://gist.github.com/thorwhalen/e8fe6c0454ab2109d4713f886b38bbda)
@@ -87,16 +159,195 @@ def acquire_content(
         assert callable(
             uri_to_content
         ), "uri_to_content must be a callable if uris is None"
-        return partial(acquire_content, uri_to_content, store=store)
+        return partial(
+            acquire_content,
+            uri_to_content,
+            store=store,
+            save_condition=save_condition,
+            concurrency=concurrency,
+            flush_bytes=flush_bytes,
+            dedupe=dedupe,
+        )
+
+    if flush_bytes:
+        store_writes = _ensure_store_func(store, flush_bytes=flush_bytes)
+    else:
+        store_writes = nullcontext(store)
+
+    with store_writes as store:
+        if inspect.iscoroutinefunction(uri_to_content):
+            return _run_coroutine(
+                _acquire_content_async(
+                    uri_to_content, uris, store, save_condition, concurrency, dedupe
+                )
+            )
+
+        # Loop through uris and store the processed content
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            contents = _map_deduped(executor.map, uri_to_content, uris, dedupe)
+            for key, content in zip(uris, contents):
+                if save_condition(content):
+                    store(key, content)
+
+
+def _distinct_uris(uris: Dict[KT, URI], dedupe: bool = True):
+    """The distinct values of uris (in order of first appearance), or None if
+    there's nothing to dedupe (no duplicates, unhashable uris, or ``dedupe=False``)"""
+    if dedupe:
+        try:
+            distinct_uris = list(dict.fromkeys(uris.values()))
+        except TypeError:  # unhashable uris, so we can't dedupe them
+            return None
+        if len(distinct_uris) < len(uris):
+            return distinct_uris
+    return None
+
+
+def _map_deduped(map_func, uri_to_content, uris: Dict[KT, URI], dedupe: bool = True):
+    """
+    Lazily yield ``uri_to_content(uri)`` for each value of ``uris``, computed with
+    ``map_func``, but only computing the content of each distinct uri once.
+
+    >>> calls = []
+    >>> def logged_upper(uri):
+    ...     calls.append(uri)
+    ...     return uri.upper()
+    >>> list(_map_deduped(map, logged_upper, {1: 'a', 2: 'b', 3: 'a', 4: 'c'}))
+    ['A', 'B', 'A', 'C']
+    >>> calls
+    ['a', 'b', 'c']
+
+    """
+    distinct_uris = _distinct_uris(uris, dedupe)
+    if distinct_uris is None:
+        yield from map_func(uri_to_content, uris.values())
+        return
+    # The distinct uris are in order of first appearance, so we'll never have to
+    # wait for a content that comes after the one we need.
+    results = zip(distinct_uris, map_func(uri_to_content, distinct_uris))
+    remaining = Counter(uris.values())
+    contents = {}
+    for uri in uris.values():
+        while uri not in contents:
+            fetched_uri, content = next(results)
+            contents[fetched_uri] = content
+        remaining[uri] -= 1
+        if remaining[uri]:
+            yield contents[uri]
+        else:  # last time we need this content, so we can let it go
+            yield contents.pop(uri)
+
+
+def _run_coroutine(coro):
+    """
+    Run the coroutine to completion, and return its result, whether an event loop is
+    running in this thread (e.g. in a notebook) or not. If it is, the coroutine is
+    run (on a loop of its own) in another thread, since ``asyncio.run`` can't run
+    there.
+
+    >>> async def answer():
+    ...     return 42
+    >>> _run_coroutine(answer())
+    42
+    >>> async def answer_from_a_running_loop():
+    ...     return _run_coroutine(answer())
+    >>> asyncio.run(answer_from_a_running_loop())
+    42
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:  # no running loop, so we can just run the coroutine
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+async def _acquire_content_async(
+    uri_to_content, uris, store, save_condition, concurrency=16, dedupe=True
+):
+    """The async version of acquire_content's loop: All uris are fetched concurrently
+    (bounded by a semaphore), sharing a single HTTP/2 client."""
+    sem = asyncio.Semaphore(concurrency)
+    distinct_uris = _distinct_uris(uris, dedupe)
+
+    async with _mk_async_client() as client:
+
+        async def _one(uri):
+            async with sem:
+                return await uri_to_content(client, uri)
 
-    # Loop through uris and store the processed content
-    for key, uri in uris.items():
-        content = uri_to_content(uri)
+        if distinct_uris is None:
+            contents = await asyncio.gather(*map(_one, uris.values()))
+        else:
+            distinct_contents = await asyncio.gather(*map(_one, distinct_uris))
+            content_of_uri = dict(zip(distinct_uris, distinct_contents))
+            contents = map(content_of_uri.__getitem__, uris.values())
+
+    for key, content in zip(uris, contents):
         if save_condition(content):
             store(key, content)
 
 
-def _ensure_store_func(store: Union[Dirpath, MutableMapping, Callable]) -> StoreFunc:
+def _size_of(content) -> int:
+    try:
+        return len(content)
+    except TypeError:
+        return 0
+
+
+class _CoalescingStore:
+    """
+    Wraps a store function, buffering the ``(key, content)`` writes and handing them
+    to the store in batches, once ``flush_bytes`` bytes (or more) have accumulated.
+
+    Use it as a context manager to make sure the remaining buffer is flushed.
+
+    >>> d = {}
+    >>> with _CoalescingStore(d.__setitem__, flush_bytes=6) as store:
+    ...     store('a', 'abc')
+    ...     print(d)
+    ...     store('b', 'def')
+    ...     print(d)
+    ...     store('c', 'g')
+    ...     print(d)
+    {}
+    {'a': 'abc', 'b': 'def'}
+    {'a': 'abc', 'b': 'def'}
+    >>> d
+    {'a': 'abc', 'b': 'def', 'c': 'g'}
+
+    """
+
+    def __init__(self, store: StoreFunc, flush_bytes: int = DFLT_COALESCE_BYTES):
+        self.store = store
+        self.flush_bytes = flush_bytes
+        self._buf = []
+        self._size = 0
+
+    def __call__(self, k, v):
+        self._buf.append((k, v))
+        self._size += _size_of(v)
+        if self._size >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        buf, self._buf, self._size = self._buf, [], 0
+        store = self.store
+        for k, v in buf:
+            store(k, v)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def _ensure_store_func(
+    store: Union[Dirpath, MutableMapping, Callable],
+    *,
+    flush_bytes: Optional[int] = None,
+) -> StoreFunc:
     """
     Ensures a store function is returned based on the type of 'store' argument provided.
 
@@ -105,6 +356,9 @@ def _ensure_store_func(store: Union[Dirpath, MutableMapping, Callable]) -> Store
     - If store is a MutableMapping, it returns the __setitem__ method of the store.
     - If none of these types match, a ValueError is raised.
 
+    If ``flush_bytes`` is given, the store function is further wrapped in a
+    ``_CoalescingStore`` that will batch the writes in ``flush_bytes`` chunks.
+
     Examples:
 
     >>> store = {}
@@ -125,46 +379,84 @@ def _ensure_store_func(store: Union[Dirpath, MutableMapping, Callable]) -> Store
     # >>> _ensure_store_func("/valid/directory/path")  # Requires dol.Files +SKIP
 
     """
+    if flush_bytes is not None:
+        store = _ensure_store_func(store)
+        if isinstance(store, _CoalescingStore):
+            return store
+        return _CoalescingStore(store, flush_bytes)
+    # Fast path: exact type lookup (subclasses fall through to the isinstance chain)
+    handler = _STORE_DISPATCH.get(type(store))
+    if handler is not None:
+        return handler(store)
     if callable(store):
         return store
     elif isinstance(store, str):
-        dirpath = os.path.expanduser(store)
-        if os.path.isdir(dirpath):
-            from dol import Files
-
-            return Files(dirpath).__setitem__
-        else:
-            raise ValueError(f"The directory path {dirpath} does not exist.")
+        return _dirpath_store_func(store)
     elif isinstance(store, MutableMapping):
-        # If store is a MutableMapping, we'll use its __setitem__ method
-        store_obj = store
-        return store_obj.__setitem__
+        return _mapping_store_func(store)
     else:
         raise ValueError(
             "uri_to_content must be a callable, or MutableMapping, or a dir path"
         )
 
 
-# A few useful uri_to_content functions, elegantly defined as (picklable) function compositions
+def _dirpath_store_func(store: Dirpath) -> StoreFunc:
+    dirpath = os.path.expanduser(store)
+    if os.path.isdir(dirpath):
+        from dol import Files
 
-from dol import Pipe
-from pathlib import Path
-import requests
-from operator import methodcaller, attrgetter
+        return Files(dirpath).__setitem__
+    else:
+        raise ValueError(f"The directory path {dirpath} does not exist.")
+
+
+def _mapping_store_func(store: MutableMapping) -> StoreFunc:
+    # If store is a MutableMapping, we'll use its __setitem__ method
+    return store.__setitem__
+
+
+def _identity(x):
+    return x
+
+
+_STORE_DISPATCH = {
+    str: _dirpath_store_func,
+    dict: _mapping_store_func,
+    **dict.fromkeys(
+        [
+            FunctionType,
+            BuiltinFunctionType,
+            MethodType,
+            MethodWrapperType,
+            partial,
+            _CoalescingStore,
+        ],
+        _identity,
+    ),
+}
+
+
+# A few useful uri_to_content functions, elegantly defined as (picklable) function compositions
 
 acquire_content.path_to_bytes = Pipe(Path, methodcaller('read_bytes'))
 acquire_content.path_to_string = Pipe(Path, methodcaller('read_text'))
 
+DFLT_CHUNK_SIZE = 2 * 1024 * 1024  # size of the chunks responses are streamed in
+
 
 @acquire_content
 def url_to_bytes(url: URI, verbose: int = 2) -> bytes:
     verbose = int(verbose)
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Check for HTTP errors
+        response = _SESSION.get(url, stream=True, timeout=DFLT_REQUEST_TIMEOUT)
+        with response:
+            response.raise_for_status()  # Check for HTTP errors
+            buffer = io.BytesIO()
+            for chunk in response.iter_content(chunk_size=DFLT_CHUNK_SIZE):
+                buffer.write(chunk)
         if verbose >= 2:
             print(f"Successfully downloaded and stored contents from {url}")
-        return response.content
+        return buffer.getvalue()
     except requests.exceptions.RequestException as e:
         if verbose >= 1:
             print(f"Failed to download from {url}: {e}")
@@ -172,43 +464,343 @@ def url_to_bytes(url: URI, verbose: int = 2) -> bytes:
 acquire_content.url_to_bytes = url_to_bytes
 
 
+def _mk_async_client(**client_kwargs):
+    """Make an httpx.AsyncClient that multiplexes requests over HTTP/2"""
+    import httpx  # pip install httpx[http2]
+
+    connect_timeout, read_timeout = DFLT_REQUEST_TIMEOUT
+    client_kwargs = dict(
+        dict(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            headers={'User-Agent': DFLT_USER_AGENT},
+        ),
+        **client_kwargs,
+    )
+    return httpx.AsyncClient(**client_kwargs)
+
+
+async def async_url_to_bytes(client, url: URI, verbose: int = 2) -> bytes:
+    """Async version of url_to_bytes, getting the contents of url with an
+    (httpx.AsyncClient) client"""
+    import httpx
+
+    verbose = int(verbose)
+    try:
+        response = await client.get(url)
+        response.raise_for_status()  # Check for HTTP errors
+        if verbose >= 2:
+            print(f"Successfully downloaded contents from {url}")
+        return response.content
+    except httpx.HTTPError as e:
+        if verbose >= 1:
+            print(f"Failed to download from {url}: {e}")
+
+
+acquire_content.async_url_to_bytes = async_url_to_bytes
+
+
+def _scrape_one(name, url, *, scrape_fn, write_queue, errors):
+    """Scrape one url and put the ``(name, url, md_content)`` result in
+    ``write_queue``, for ``_write_all`` to save it.
+
+    If scraping fails (or gets no content, e.g. for a site that can't be reached),
+    the ``(name, url)`` pair is appended to ``errors``.
+    """
+    try:
+        print_progress(f"Scraping {name} ({url})...")
+        md_content = scrape_fn(url)
+        if not md_content:
+            raise ValueError("Got no content")
+    except Exception as e:
+        print(f"Error scraping {name} ({url}): {e}")
+        print("Continuing (but returning (name, url) pair in output dict)...")
+        errors.append((name, url))
+        return
+    write_queue.put((name, url, md_content))
+
+
+def _write_all(write_queue, write, errors):
+    """Save the ``(name, url, md_content)`` items of ``write_queue`` (with
+    ``write(name, md_content)``), until a ``None`` item is received.
+
+    Having a single writer (thread), fed by a queue, lets the scrapes go on while
+    contents are being written.
+    """
+    while (item := write_queue.get()) is not None:
+        name, url, md_content = item
+        try:
+            write(name, md_content)
+        except Exception as e:
+            print(f"Error saving {name} ({url}): {e}")
+            errors.append((name, url))
+
+
+DFLT_WRITE_BUFFER_SIZE = 2 * 1024 * 1024
+DFLT_WRITE_QUEUE_SIZE = 32
+
+
+def _write_text(filepath: str, text: str, buffer_size: int = DFLT_WRITE_BUFFER_SIZE):
+    """Write text to filepath atomically: The file is either fully written, or absent.
+
+    (The text is written to a temporary file, which is then moved to filepath.)
+    """
+    tmp_filepath = _tmp_filepath(filepath)
+    try:
+        # a large buffer amortizes the syscalls when writing large markdown contents
+        with open(tmp_filepath, "w", encoding="utf-8", buffering=buffer_size) as f:
+            f.write(text)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_filepath)
+        raise
+
+
+def _tmp_filepath(filepath) -> str:
+    """A temporary filepath to write filepath's contents to (before moving them
+    there), that's only this thread's, so that concurrent writes of the same file
+    don't write to (or move) each other's temporary files"""
+    return f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+class _MarkdownDirWriter:
+    """Writes markdown contents to ``{name}.md`` files of a directory"""
+
+    def __init__(self, save_dir: Path):
+        self.save_dir = save_dir
+
+    def __call__(self, name: str, md_content: str):
+        _write_text(self.save_dir / f"{name}.md", md_content)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _MarkdownTarZstWriter:
+    """Writes markdown contents as ``{name}.md`` members of a single, zstandard
+    compressed, tar file (instead of paying the filesystem overhead of one file per
+    content).
+
+    Like the files of ``_MarkdownDirWriter``, the archive is written atomically: It
+    only appears at ``filepath`` once it's closed.
+    """
+
+    def __init__(self, filepath: Path, *, level: int = 3):
+        import zstandard  # pip install zstandard
+
+        self.filepath = filepath
+        self._tmp_filepath = _tmp_filepath(filepath)
+        self._zstd_writer = zstandard.ZstdCompressor(level=level).stream_writer(
+            open(self._tmp_filepath, 'wb')
+        )
+        self._tar = tarfile.open(mode='w|', fileobj=self._zstd_writer)
+        self._lock = threading.Lock()  # tar members must be written one at a time
+
+    def __call__(self, name: str, md_content: str):
+        data = md_content.encode('utf-8')
+        info = tarfile.TarInfo(f"{name}.md")
+        info.size = len(data)
+        info.mtime = int(time.time())
+        with self._lock:
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._tar.close()
+        self._zstd_writer.close()  # also closes the underlying file
+        if exc_type is None:
+            os.replace(self._tmp_filepath, self.filepath)
+        else:  # don't leave an incomplete archive around
+            os.remove(self._tmp_filepath)
+
+
+def _cache_name(fn: Callable) -> Optional[str]:
+    """
+    A name for the cache of fn's results (that other functions won't have), or None
+    if fn has no such (stable) name, like lambdas, local functions, partials, or
+    (bound) methods.
+
+    >>> _cache_name(str.upper), _cache_name(len)
+    ('str.upper', 'builtins.len')
+    >>> _cache_name(lambda url: url), _cache_name(partial(len)), _cache_name('a'.upper)
+    (None, None, None)
+    """
+    qualname = getattr(fn, '__qualname__', None)
+    if qualname is None or '<' in qualname:  # e.g. '<lambda>', 'f.<locals>.g'
+        return None
+    # Builtin functions are "bound" to their module, which is fine
+    bound_to = getattr(fn, '__self__', None)
+    if bound_to is not None and not inspect.ismodule(bound_to):
+        return None  # a method's results depend on its instance, not just its name
+    module = getattr(fn, '__module__', None)
+    return f"{module}.{qualname}" if module else qualname
+
+
+def _cached(fn: Callable[..., str], cache_dir: str, ttl: Optional[float] = None):
+    """
+    Wrap a ``fn(url, ...) -> str`` function so that its results are cached on disk.
+
+    Results are saved in ``cache_dir``, under the sha1 hash of the url, and read from
+    there on subsequent calls (unless they are older than ``ttl`` seconds). Empty
+    results (e.g. of a site that couldn't be reached) aren't cached.
+
+    >>> from tempfile import mkdtemp
+    >>> calls = []
+    >>> def scrape(url):
+    ...     calls.append(url)
+    ...     return url.upper()
+    >>> cached_scrape = _cached(scrape, mkdtemp())
+    >>> cached_scrape('http://a.com'), cached_scrape('http://a.com')
+    ('HTTP://A.COM', 'HTTP://A.COM')
+    >>> calls
+    ['http://a.com']
+
+    """
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+
+    @wraps(fn)
+    def cached_fn(url, *args, **kwargs):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        filepath = os.path.join(cache_dir, f"{key}.md")
+        if os.path.isfile(filepath) and (
+            ttl is None or time.time() - os.path.getmtime(filepath) < ttl
+        ):
+            return Path(filepath).read_text(encoding='utf-8')
+        result = fn(url, *args, **kwargs)
+        if result:
+            # atomic, so no truncated entry can be read
+            _write_text(filepath, result)
+        return result
+
+    return cached_fn
+
+
 def scrape_multiple_sites(
     name_and_url: dict,
     save_dir: str = ".",
     *,
-    url_scrape_function: callable = markdown_of_site_depth_3,
+    url_scrape_function: Optional[Callable[[str], str]] = None,
+    depth: int = 3,
+    concurrency: int = 16,
+    force_rescrape: bool = False,
+    cache_dir: Optional[str] = DFLT_CACHE_DIR,
+    cache_ttl: Optional[float] = None,
+    store_kind: Literal['dir', 'tar.zst'] = 'dir',
 ):
     """
     Scrape multiple URLs and save the results to a directory.
 
+    The sites are scraped concurrently, with at most ``concurrency`` of them being
+    scraped at any given time.
+
+    Scrapes are cached (by url) in ``cache_dir``, so that re-running over sites
+    that were already scraped doesn't redo the network work. Scrapes older than
+    ``cache_ttl`` seconds are redone, and ``cache_dir=None`` disables the cache. A
+    custom ``url_scrape_function`` has a cache of its own (named after it), and
+    isn't cached if it has no (stable) name to do so (e.g. a lambda, or a partial).
+    Also, names whose markdown file already exists in ``save_dir`` are skipped, so
+    an interrupted run can be resumed. Use ``force_rescrape=True`` to bypass both
+    (and refresh the cache).
+
     Args:
     - name_and_url: a dictionary mapping names to URLs
     - save_dir: the directory to save the results to
-    - url_scrape_function: the function to use to scrape the URLs
+    - url_scrape_function: the function to use to scrape the URLs (called with
+        the url as only argument). Defaults to ``markdown_of_site`` (with ``depth``)
+    - depth: the depth to scrape sites at, when using the default
+        ``url_scrape_function``
+    - concurrency: the maximum number of sites to scrape at the same time
+    - force_rescrape: if True, scrape (and save) the sites even if they were scraped
+        before
+    - cache_dir: the directory where scrapes are cached (None: don't cache them)
+    - cache_ttl: how long (in seconds) a cached scrape can be used for. If None (the
+        default), cached scrapes are used however old they are
+    - store_kind: how to save the markdown contents: 'dir' (the default) saves
+        them as ``{name}.md`` files of ``save_dir``, and 'tar.zst' saves them as
+        ``{name}.md`` members of a single ``scraped.tar.zst`` archive of
+        ``save_dir`` (requires the ``zstandard`` package). Note that the archive is
+        rewritten with all the contents on every call (the cache makes that cheap).
+
+    Returns:
+    - A dict of the (name, url) pairs that could not be scraped.
 
     """
-    from lkj import print_progress
-    import scraped
-    import os
-
-    save_dir = os.path.abspath(os.path.expanduser(save_dir))
+    save_dir = Path(save_dir).expanduser().resolve()
     # raise if save_dir is not a directory
-    if not os.path.isdir(save_dir):
+    if not save_dir.is_dir():
         raise NotADirectoryError(f"{save_dir} is not a directory")
 
-    def gen():
-        for i, (name, url) in enumerate(name_and_url.items(), 1):
-            try:
-                print_progress(f"Scraping {name} ({url})...")
-                md_content = url_scrape_function(url, depth=3)
-                with open(f"{save_dir}/{name}.md", "w") as f:
-                    f.write(md_content)
-            except Exception as e:
-                print(f"Error scraping {name} ({url}): {e}")
-                print("Continuing (but returning (name, url) pair in output dict)...")
-                yield name, url
-
-    return dict(gen())
+    if url_scrape_function is None:
+        url_scrape_function = partial(markdown_of_site, depth=depth)
+        # so that scrapes of different depths don't get mixed up in the cache
+        cache_name = f"markdown_of_site_depth_{depth}"
+    else:
+        # so that different functions don't get each other's results from the cache
+        cache_name = _cache_name(url_scrape_function)
+
+    if cache_dir is not None and cache_name is not None:
+        # with a ttl of 0, the cache is never read, but is still refreshed
+        url_scrape_function = _cached(
+            url_scrape_function,
+            os.path.join(cache_dir, cache_name),
+            ttl=0 if force_rescrape else cache_ttl,
+        )
+
+    if store_kind == 'dir':
+        writer = _MarkdownDirWriter(save_dir)
+    elif store_kind == 'tar.zst':
+        writer = _MarkdownTarZstWriter(save_dir / 'scraped.tar.zst')
+    else:
+        raise ValueError(f"store_kind must be 'dir' or 'tar.zst', not {store_kind!r}")
+
+    if force_rescrape or store_kind != 'dir':
+        already_scraped = set()
+    else:
+        # One directory read, instead of one stat per name. Files are written
+        # atomically (through a temporary file that is then moved to the .md file),
+        # so existing .md files are complete.
+        with os.scandir(save_dir) as entries:
+            already_scraped = {
+                e.name for e in entries if e.name.endswith('.md') and e.is_file()
+            }
+
+    errors = []
+    # bounded, so that scrapes wait (instead of piling up contents in memory) if
+    # writing falls behind
+    write_queue = queue.Queue(maxsize=DFLT_WRITE_QUEUE_SIZE)
+    writer_thread = threading.Thread(
+        target=_write_all, args=(write_queue, writer, errors), daemon=True
+    )
+
+    # Threads (not an event loop), so that this also works where a loop is already
+    # running (e.g. in a notebook), and since the scrape function is sync anyway
+    with writer:
+        writer_thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for name, url in name_and_url.items():
+                    if f"{name}.md" not in already_scraped:
+                        executor.submit(
+                            _scrape_one,
+                            name,
+                            url,
+                            scrape_fn=url_scrape_function,
+                            write_queue=write_queue,
+                            errors=errors,
+                        )
+        finally:
+            write_queue.put(None)  # tell the writer we're done
+            writer_thread.join()
+
+    return dict(errors)
 
 
 def main():
@@ -1,17 +1,38 @@
 """Utils for scraped."""
 
 import os
-from functools import partial
-from typing import Iterable, Mapping, Optional, Callable, Union, Tuple, List, Dict
+from functools import partial, lru_cache
+from contextlib import ExitStack
+from typing import (
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Callable,
+    Union,
+    Tuple,
+    List,
+    Dict,
+)
+import sys
+import atexit
+import warnings
+import pickle
+import queue
+import itertools
+import threading
 import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import re
-from tempfile import TemporaryDirectory
 from pathlib import Path
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlsplit, urljoin
 
 import scrapy
 from scrapy.crawler import CrawlerProcess
 from scrapy.linkextractors import LinkExtractor
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.threads import deferToThread
 
 import html2text
 from config2py import get_app_data_folder
@@ -19,8 +40,11 @@ from graze.base import url_to_localpath as graze_url_to_localpath
 
 _DFLT_DATA_ROOTDIR = get_app_data_folder('scraped/data', ensure_exists=True)
 DFLT_ROOTDIR = os.environ.get('SCRAPED_DFLT_ROOTDIR', _DFLT_DATA_ROOTDIR)
+_DFLT_CACHE_ROOTDIR = get_app_data_folder('scraped/cache', ensure_exists=True)
+DFLT_CACHE_DIR = os.environ.get('SCRAPED_DFLT_CACHE_DIR', _DFLT_CACHE_ROOTDIR)
 
 
+@lru_cache(maxsize=2**16)  # the same urls (e.g. navigation links) come up a lot
 def url_to_localpath(url: str, rootdir: str = DFLT_ROOTDIR) -> str:
     """Convert a URL to a local file path, considering slashes as marking directories"""
     path = graze_url_to_localpath(url)
@@ -29,14 +53,47 @@ def url_to_localpath(url: str, rootdir: str = DFLT_ROOTDIR) -> str:
     return path
 
 
+def make_url_to_localpath(rootdir: str = DFLT_ROOTDIR) -> Callable[[str], str]:
+    """
+    Make a ``url_to_localpath`` function for a fixed rootdir, which is joined to the
+    paths by a simple concatenation to a precomputed prefix.
+
+    >>> f = make_url_to_localpath('/root/dir')
+    >>> url = 'https://example.com/a/b.html'
+    >>> f(url) == url_to_localpath(url, rootdir='/root/dir')
+    True
+    """
+    if not rootdir:
+        return graze_url_to_localpath
+    prefix = os.path.join(rootdir, '')  # rootdir, ending with a separator
+
+    def _url_to_localpath(url: str) -> str:
+        path = graze_url_to_localpath(url)
+        # an absolute path is its own path, as it is for os.path.join
+        return path if os.path.isabs(path) else prefix + path
+
+    return _url_to_localpath
+
+
+_URL_FILENAME_RE = re.compile(r'https?://|/')
+
+
+def _url_filename_replacement(match: re.Match) -> str:
+    return '__' if match.group(0) == '/' else ''
+
+
 def url_to_filename(url: str) -> str:
     """
     Convert a URL to a filename (getting rid of http header and slashes)
+
+    >>> url_to_filename('https://www.example.com/some/page/')
+    'www.example.com__some__page'
     """
     # remove slash suffix if there
-    if url[-1] == '/':
+    if url.endswith('/'):
         url = url[:-1]
-    return url.replace('https://', '').replace('http://', '').replace('/', '__')
+    # one pass to remove the http headers and replace the slashes
+    return _URL_FILENAME_RE.sub(_url_filename_replacement, url)
 
 
 # def explicit_url(response) -> str:
@@ -80,21 +137,57 @@ def url_to_filename(url: str) -> str:
 #     return url
 
 
+def _non_none_items(**kwargs) -> dict:
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+
+# Settings for scrapy to cache responses (on disk), and revalidate the stale ones
+# with conditional requests (If-Modified-Since, If-None-Match), following RFC2616.
+# The cache isn't under the rootdir of the downloads, since it would add files there.
+HTTP_CACHE_SETTINGS = {
+    'HTTPCACHE_ENABLED': True,
+    'HTTPCACHE_POLICY': 'scrapy.extensions.httpcache.RFC2616Policy',
+    'HTTPCACHE_STORAGE': 'scrapy.extensions.httpcache.FilesystemCacheStorage',
+    'HTTPCACHE_DIR': os.path.join(DFLT_CACHE_DIR, 'httpcache'),
+}
+
+DFLT_SPIDER_IO_WORKERS = 8  # number of threads writing the downloaded files
+# Downloads are written in batches, as soon as one of these is reached
+WRITE_BATCH_MAX_FILES = 32
+WRITE_BATCH_MAX_BYTES = 16 * 1024 * 1024
+
+
 class RecursiveDownloader(scrapy.Spider):
     """
     A Scrapy spider that recursively downloads contents from a given URL to a local dir.
 
     :param start_url: The URL to start downloading from.
-    :param url_to_filepath: The function to convert URLs to local filepaths.
+    :param url_to_filepath: The function to convert URLs to local filepaths
+        (defaults to ``url_to_localpath``).
     :param depth: The maximum depth to follow links.
-    :param filter_urls: A function to filter URLs to download.
+    :param filter_urls: A function to filter URLs to download (or a regex that the
+        URLs to download must match).
     :param mk_missing_dirs: Whether to create missing directories.
     :param verbosity: The verbosity level.
     :param rootdir: The root directory to save the downloaded files.
-    :param extra_kwargs: Extra keyword arguments to pass to the Scrapy spider.
+    :param durable: Whether to flush the written files to disk (``os.sync``) once
+        the crawl is over (instead of leaving that to the OS).
+    :param http_cache: Whether to cache the responses (see ``HTTP_CACHE_SETTINGS``),
+        so that a re-crawl only gets the pages that changed (or have no caching
+        information) from the server.
+    :param overwrite: Whether to overwrite the files that were already downloaded.
+        If False, the (non-empty) files already there are left as is, so that a
+        resumed crawl only writes the new pages (the others are still requested,
+        to get their links).
+    :param concurrent_requests: The maximum number of concurrent requests (if not
+        given, the crawler's ``CONCURRENT_REQUESTS`` setting).
+    :param per_domain_concurrency: The maximum number of concurrent requests to the
+        domain (if not given, the crawler's ``CONCURRENT_REQUESTS_PER_DOMAIN``).
+    :param extra_kwargs: Extra Scrapy settings for the crawl (e.g. ``DOWNLOAD_DELAY``).
     """
 
     name = "recursive_downloader"
+    crawl_output = None  # what the crawl gives back (to the process that ran it)
 
     def __init__(
         self,
@@ -102,67 +195,287 @@ class RecursiveDownloader(scrapy.Spider):
         rootdir: str = DFLT_ROOTDIR,
         *,
         depth: int = 1,
-        filter_urls: Optional[Callable[[str], bool]] = None,
+        filter_urls: Optional[Union[str, re.Pattern, Callable[[str], bool]]] = None,
         mk_missing_dirs: bool = True,
         verbosity: int = 0,
         url_to_filepath: Optional[Union[str, Callable[[str], str]]] = None,
+        durable: bool = False,
+        http_cache: bool = False,
+        overwrite: bool = True,
+        concurrent_requests: Optional[int] = None,
+        per_domain_concurrency: Optional[int] = None,
         **extra_kwargs,
     ):
         self.start_urls = [start_url]
-        self.allowed_domains = [urlparse(start_url).netloc]
-        self.url_to_filepath = partial(url_to_filepath, rootdir=rootdir)
+        start = urlsplit(start_url)  # parsed once, for all that needs it
+        # kept for whatever needs it (e.g. subclasses), so the url isn't reparsed
+        self._start_netloc = _netloc_without_default_port(start)
+        # scrapy's offsite filter ignores domains with a port, so we use the hostname
+        self.allowed_domains = [start.hostname or start.netloc]
+        if url_to_filepath in (None, url_to_localpath):
+            self.url_to_filepath = make_url_to_localpath(rootdir)
+        else:
+            self.url_to_filepath = partial(url_to_filepath, rootdir=rootdir)
         self.depth = depth
-        self.filter_urls = filter_urls
+        # a regex filter is applied by the link extractor, so we don't need it here
+        self.filter_urls = filter_urls if callable(filter_urls) else None
         self.mk_missing_dirs = mk_missing_dirs
+        # urls of the links we've already considered (starting with the start url,
+        # which scrapy wouldn't filter out as a duplicate)
+        self._seen_links = {start_url}
+        # The link extractor is stateless, so made once, and reused. It only extracts
+        # the links to our domain (or its subdomains), since scrapy would filter the
+        # other (offsite) requests anyway, and (if filter_urls is a regex) that match
+        # filter_urls, so we don't even make requests for the other links.
+        self._link_extractor = LinkExtractor(
+            allow=filter_urls if isinstance(filter_urls, (str, re.Pattern)) else (),
+            # compared with the links' netlocs (with a port, unless it's the default)
+            allow_domains=[self._start_netloc],
+            unique=True,
+        )
+        self.durable = durable
+        self.overwrite = overwrite
+        self._log_downloads = verbosity > 0
+        # Files are written in threads, so the reactor doesn't wait for the disk
+        self._io_pool = ThreadPoolExecutor(
+            DFLT_SPIDER_IO_WORKERS, thread_name_prefix='scraped-io'
+        )
+        self._write_batch = []  # (filepath, contents) pairs waiting to be written
+        self._write_batch_bytes = 0
         self.custom_settings = {
             'LOG_LEVEL': ['ERROR', 'INFO', 'DEBUG'][verbosity],
             'DEPTH_STATS': True,
             'DEPTH_PRIORITY': 1,
+            **(HTTP_CACHE_SETTINGS if http_cache else {}),
+            **_non_none_items(
+                CONCURRENT_REQUESTS=concurrent_requests,
+                CONCURRENT_REQUESTS_PER_DOMAIN=per_domain_concurrency,
+            ),
             **extra_kwargs,
             'LOG_FORMAT': '%(levelname)s: %(message)s',
             'LOG_FILE': None,  # Disable logging to file
         }
         super().__init__()
 
-    def parse(self, response: scrapy.http.Response):
-        url = response.url
-        filepath = self.url_to_filepath(url)
-        dirpath = os.path.dirname(filepath)
-
-        if not os.path.exists(dirpath):
-            if self.mk_missing_dirs:
-                os.makedirs(dirpath)
-            else:
-                raise FileNotFoundError(
-                    f"Directory (needed to save scrapes) not found: {dirpath}"
-                )
-
-        with open(filepath, 'wb') as f:
-            f.write(response.body)
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # Scrapy only reads the custom_settings of the class, so apply the instance's.
+        # That's possible with scrapy>=2.11, where settings are frozen after the
+        # spider is created.
+        if crawler.settings.frozen:
+            warnings.warn(
+                f"The crawler's settings are already frozen (scrapy<2.11?), so the "
+                f"settings of the {cls.__name__} instance are ignored"
+            )
+        else:
+            crawler.settings.setdict(spider.custom_settings, priority='spider')
+        return spider
 
-        if self.custom_settings['LOG_LEVEL'] != 'ERROR':
-            self.log(f"Downloaded {response.url} to {filepath}")
+    def parse(self, response: scrapy.http.Response):
+        self.save(response)
 
         depth = response.meta.get('depth', 0)
 
         if depth < self.depth:
-            link_extractor = LinkExtractor()
-            for link in link_extractor.extract_links(response):
+            for link in self._link_extractor.extract_links(response):
+                # Links shared by many pages (navigation, footers...) are only
+                # considered once (scrapy would drop the duplicate requests anyway)
+                if link.url in self._seen_links:
+                    continue
+                self._seen_links.add(link.url)
                 if not self.filter_urls or self.filter_urls(link.url):
                     yield response.follow(
                         link.url, self.parse, meta={'depth': depth + 1}
                     )
 
+    def save(self, response: scrapy.http.Response):
+        """Save the contents of the response (to the file for its url)"""
+        filepath = self.url_to_filepath(response.url)
+        # Missing directories are handled by the I/O threads, when they write
+        if not self.overwrite and _is_non_empty_file(filepath):
+            if self._log_downloads:
+                self.log(f"Skipped {response.url}: {filepath} already exists")
+            return
+
+        self._write_batch.append((filepath, response.body))
+        self._write_batch_bytes += len(response.body)
+        if (
+            len(self._write_batch) >= WRITE_BATCH_MAX_FILES
+            or self._write_batch_bytes >= WRITE_BATCH_MAX_BYTES
+        ):
+            self._flush_write_batch()
+
+        if self._log_downloads:
+            self.log(f"Downloaded {response.url} to {filepath}")
+
+    def _flush_write_batch(self):
+        """Hand the batch of pending writes over to the I/O threads"""
+        if self._write_batch:
+            write = self._io_pool.submit(
+                _write_files, self._write_batch, mk_missing_dirs=self.mk_missing_dirs
+            )
+            write.add_done_callback(self._log_write_errors)
+            self._write_batch, self._write_batch_bytes = [], 0
+
+    def _log_write_errors(self, write: Future):
+        for filepath, error in write.result():
+            self.logger.error(f"Failed to save a download to {filepath}: {error!r}")
+
+    async def closed(self, reason):
+        self._flush_write_batch()
+        # The pending writes are waited for in a thread, so that the reactor (that
+        # other crawls may share) goes on meanwhile
+        await maybe_deferred_to_future(deferToThread(self._finish_writes))
+
+    def _finish_writes(self):
+        self._io_pool.shutdown(wait=True)  # wait for the pending writes
+        # One sync for the whole crawl, rather than one per file
+        if self.durable:
+            os.sync()
+
+
+class MarkdownSpider(RecursiveDownloader):
+    """
+    A ``RecursiveDownloader`` that, instead of saving the pages it downloads, converts
+    the html ones to markdown (in memory). Once the crawl is done, ``crawl_output`` is
+    the list of these markdowns, in the order the pages were downloaded.
+
+    :param converter: The html to markdown converter (see ``html_to_markdown``).
+    :param html2text_options: Options for the html2text converter.
+
+    The other arguments are those of ``RecursiveDownloader``.
+    """
+
+    name = "markdown_spider"
+
+    def __init__(
+        self,
+        start_url: str,
+        *,
+        converter: Union[str, Callable[[str], str]] = 'html2text',
+        html2text_options: Optional[Mapping] = None,
+        **kwargs,
+    ):
+        super().__init__(start_url, **kwargs)
+        self._convert = _mk_html_converter(converter, html2text_options or {})
+        # One thread, so the (stateful) converter converts one page at a time
+        self._convert_pool = ThreadPoolExecutor(1, thread_name_prefix='scraped-md')
+        # The futures of the markdowns, in download order. Keyed by url, so that, as
+        # with files, a url downloaded again (e.g. via a redirect) replaces the first
+        self._conversions = {}
+
+    def save(self, response: scrapy.http.Response):
+        if not _is_html_response(response):
+            return  # e.g. the json, xml, or text files that links lead to
+        # scrapy decodes the text with the charset of the headers (or html meta tags)
+        if isinstance(response, scrapy.http.TextResponse):
+            html = response.text
+        else:
+            html = response.body
+        self._conversions[response.url] = self._convert_pool.submit(
+            _html_to_md, self._convert, html
+        )
+
+    async def closed(self, reason):
+        await super().closed(reason)
+        # As for the writes, the conversions are waited for off the reactor
+        await maybe_deferred_to_future(deferToThread(self._collect_markdowns))
+
+    def _collect_markdowns(self):
+        self._convert_pool.shutdown(wait=True)
+        markdowns = []
+        for url, conversion in self._conversions.items():
+            try:
+                markdown = conversion.result()
+            except Exception as e:  # one page shouldn't lose us the whole site
+                self.logger.error(f"Failed to convert {url} to markdown: {e!r}")
+                continue
+            if markdown is not None:
+                markdowns.append(markdown)
+        self.crawl_output = markdowns
+
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _netloc_without_default_port(url_parts) -> str:
+    """
+    The netloc of the (split) url, without the port if it's the scheme's default one
+    (as in the links of the site, which don't usually spell it out)
+
+    >>> _netloc_without_default_port(urlsplit('https://example.com:443/a'))
+    'example.com'
+    >>> _netloc_without_default_port(urlsplit('http://localhost:8765/'))
+    'localhost:8765'
+    """
+    hostname = url_parts.hostname or url_parts.netloc
+    if url_parts.port in (None, _DEFAULT_PORTS.get(url_parts.scheme)):
+        return hostname
+    return f"{hostname}:{url_parts.port}"
+
+
+def _is_html_response(response: scrapy.http.Response) -> bool:
+    """Whether the response is html (according to its Content-Type, if it has one)"""
+    content_type = response.headers.get('Content-Type')
+    if content_type is not None:
+        return b'html' in content_type.lower()  # text/html, application/xhtml+xml
+    return is_html_content(response.body)
+
+
+def _is_non_empty_file(filepath: str) -> bool:
+    try:
+        return os.stat(filepath).st_size > 0
+    except OSError:  # no such file, or can't tell
+        return False
+
+
+def _write_files(
+    filepaths_and_contents: Iterable[Tuple[str, bytes]], *, mk_missing_dirs=False
+):
+    """Write the contents to their filepaths, returning the (filepath, error) pairs of
+    the writes that failed (so that one failure doesn't cancel the rest of the batch)
+    """
+    errors = []
+    for filepath, contents in filepaths_and_contents:
+        try:
+            try:
+                _write_bytes(filepath, contents)
+            except FileNotFoundError:
+                # Only then deal with the directory: No need to check for it beforehand
+                dirpath = os.path.dirname(filepath)
+                if not mk_missing_dirs:
+                    raise FileNotFoundError(
+                        f"Directory (needed to save scrapes) not found: {dirpath}"
+                    )
+                os.makedirs(dirpath, exist_ok=True)
+                _write_bytes(filepath, contents)
+        except OSError as error:
+            errors.append((filepath, error))
+    return errors
+
+
+def _write_bytes(filepath: str, data: bytes):
+    """Write data to filepath, with raw (unbuffered) os-level writes (no fsync)"""
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:  # os.write may write less than asked for
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
 
 def _download_site(
     url: str,
     url_to_filepath: Optional[Union[str, Callable[[str], str]]] = None,
     *,
     depth: int = 1,
-    filter_urls: Optional[Callable[[str], bool]] = None,
+    filter_urls: Optional[Union[str, re.Pattern, Callable[[str], bool]]] = None,
     mk_missing_dirs: bool = True,
     verbosity: int = 0,
     rootdir: str = DFLT_ROOTDIR,
+    crawler_settings: Optional[dict] = None,
     **extra_kwargs,
 ):
     """
@@ -171,38 +484,441 @@ def _download_site(
     :param start_url: The URL to start downloading from.
     :param url_to_filepath: The function to convert URLs to local filepaths.
     :param depth: The maximum depth to follow links.
-    :param filter_urls: A function to filter URLs to download.
+    :param filter_urls: A function to filter URLs to download (or a regex that the
+        URLs to download must match).
     :param mk_missing_dirs: Whether to create missing directories.
     :param verbosity: The verbosity level.
     :param rootdir: The root directory to save the downloaded files.
+    :param crawler_settings: Scrapy settings to use for the crawl, on top of (and
+        overriding) ``DFLT_CRAWLER_SETTINGS``.
     :param extra_kwargs: Extra keyword arguments to pass to the Scrapy spider.
 
     """
 
-    process = CrawlerProcess(
-        {
-            'LOG_LEVEL': ['ERROR', 'INFO', 'DEBUG'][verbosity],
-            'LOG_FORMAT': '%(levelname)s: %(message)s',
-            'LOG_FILE': None,  # Disable logging to file
-        }
-    )
-    process.crawl(
+    _run_crawl(
         RecursiveDownloader,
-        start_url=url,
-        url_to_filepath=url_to_filepath,
-        depth=depth,
-        filter_urls=filter_urls,
-        mk_missing_dirs=mk_missing_dirs,
-        verbosity=verbosity,
-        rootdir=rootdir,
-        **extra_kwargs,
+        _crawler_settings(verbosity, crawler_settings),
+        dict(
+            start_url=url,
+            url_to_filepath=url_to_filepath,
+            depth=depth,
+            filter_urls=filter_urls,
+            mk_missing_dirs=mk_missing_dirs,
+            verbosity=verbosity,
+            rootdir=rootdir,
+            **extra_kwargs,
+        ),
     )
+
+
+def _run_crawl(spidercls, settings: dict, spider_kwargs: dict):
+    """Crawl (in this process, with a ``CrawlerProcess``), returning the crawl_output
+    of the spider"""
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(spidercls)
+    process.crawl(crawler, **spider_kwargs)
     process.start()
+    return crawler.spider.crawl_output
+
+
+def _send_crawl_output(sender, spidercls, settings: dict, spider_kwargs: dict):
+    sender.send(_run_crawl(spidercls, settings, spider_kwargs))
+    sender.close()
+
+
+# How long (in seconds) to wait for a crawl before stopping it (None: no limit)
+DFLT_CRAWL_TIMEOUT = None
+
+
+def _mp_context():
+    """The multiprocessing context to make crawling processes with"""
+    # A running (or installed) reactor wouldn't survive a fork: Spawn then
+    return multiprocessing.get_context(
+        'spawn' if 'twisted.internet.reactor' in sys.modules else None
+    )
+
+
+def _crawl_in_new_process(
+    spidercls,
+    settings: dict,
+    spider_kwargs: dict,
+    *,
+    timeout: Optional[float] = DFLT_CRAWL_TIMEOUT,
+    ctx=None,
+):
+    """Crawl in a process of its own, returning the crawl_output of the spider"""
+    ctx = ctx or _mp_context()
+    receiver, sender = ctx.Pipe(duplex=False)
+    p = ctx.Process(
+        target=_send_crawl_output, args=(sender, spidercls, settings, spider_kwargs)
+    )
+    p.start()
+    sender.close()  # so that receiving fails, instead of hanging, if p dies
+    try:
+        if timeout is not None and not receiver.poll(timeout):
+            # Giving up on the crawl: Stop it, so it doesn't go on writing files
+            p.terminate()
+            p.join()
+            raise RuntimeError(f"The crawl took more than {timeout} seconds")
+        crawl_output = receiver.recv()
+    except EOFError:
+        crawl_output = None
+    finally:
+        receiver.close()
+    p.join()
+    if p.exitcode != 0:
+        raise RuntimeError(f"The crawl process failed (exit code: {p.exitcode})")
+    return crawl_output
+
+
+def _crawl(
+    spidercls,
+    settings: dict,
+    spider_kwargs: dict,
+    *,
+    in_process: bool = False,
+    reuse_worker: bool = False,
+    timeout: Optional[float] = DFLT_CRAWL_TIMEOUT,
+):
+    """Crawl (see ``download_site`` for the ways to do so), returning the crawl_output
+    of the spider"""
+    if in_process:
+        return _in_process_crawler()(
+            spidercls, settings, spider_kwargs, timeout=timeout
+        )
+    elif reuse_worker and _can_be_pickled(spider_kwargs):
+        try:
+            return _get_crawl_worker().crawl(
+                spidercls, settings, spider_kwargs, timeout=timeout
+            )
+        except _CrawlJobNotLoaded:
+            pass  # e.g. a filter_urls function of __main__, that the worker can't get
+    # One process for this crawl
+    ctx = _mp_context()
+    if ctx.get_start_method() == 'spawn':
+        # A spawned process (unlike a forked one) needs its arguments pickled
+        unpicklable = [k for k, v in spider_kwargs.items() if not _can_be_pickled(v)]
+        if unpicklable and _in_process_crawler.cache_info().currsize:
+            # The reactor that made us spawn is the one in-process crawls run on
+            return _in_process_crawler()(
+                spidercls, settings, spider_kwargs, timeout=timeout
+            )
+        elif unpicklable:
+            raise TypeError(
+                f"These crawl arguments can't be pickled, so can't be sent to a new "
+                f"process: {', '.join(unpicklable)}. Use in_process=True, or "
+                f"arguments that can be pickled (e.g. module level functions)."
+            )
+    return _crawl_in_new_process(
+        spidercls, settings, spider_kwargs, timeout=timeout, ctx=ctx
+    )
+
+
+# Scrapy's defaults (16 concurrent requests, 8 per domain, 10 reactor threads) are
+# conservative for the (single site, many pages) crawls we do
+DFLT_CRAWLER_SETTINGS = {
+    'CONCURRENT_REQUESTS': 32,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+    'REACTOR_THREADPOOL_MAXSIZE': 20,  # the thread pool DNS lookups are made in
+    'DNS_TIMEOUT': 30,
+    'RETRY_ENABLED': True,
+    # Adapt the delay between requests to the server's latency (from no delay)
+    'AUTOTHROTTLE_ENABLED': True,
+    'AUTOTHROTTLE_START_DELAY': 0,
+    'AUTOTHROTTLE_TARGET_CONCURRENCY': 8,
+    # scrapy's DNS cache is per process, so it's shared by the crawls of a worker
+    'DNSCACHE_ENABLED': True,
+    'DNSCACHE_SIZE': 10000,
+}
+
+
+def _crawler_settings(verbosity: int = 0, crawler_settings: Optional[dict] = None):
+    return {
+        **DFLT_CRAWLER_SETTINGS,
+        **(crawler_settings or {}),
+        'LOG_LEVEL': ['ERROR', 'INFO', 'DEBUG'][verbosity],
+        'LOG_FORMAT': '%(levelname)s: %(message)s',
+        'LOG_FILE': None,  # Disable logging to file
+    }
+
+
+def _configure_reactor(reactor, runner, *, busy_threads: int = 0):
+    """
+    Install the DNS resolver of the runner's settings on the reactor, and size the
+    reactor's thread pool (where DNS lookups are made) according to them.
+
+    ``CrawlerProcess.start`` does this, but ``CrawlerRunner`` doesn't, so without it,
+    the ``DNSCACHE_*``, ``DNS_TIMEOUT`` and ``REACTOR_THREADPOOL_MAXSIZE`` settings
+    would have no effect on the crawls of a runner.
+    ``busy_threads`` is the number of pool threads that are taken by something else.
+    """
+    from scrapy.utils.misc import load_object
+
+    resolver_class = load_object(runner.settings['DNS_RESOLVER'])
+    resolver_class.from_crawler(runner, reactor=reactor).install_on_reactor()
+    maxthreads = runner.settings.getint('REACTOR_THREADPOOL_MAXSIZE') + busy_threads
+    reactor.getThreadPool().adjustPoolsize(maxthreads=maxthreads)
+
+
+@lru_cache(maxsize=1)
+def _in_process_crawler():
+    """
+    Make (once) a function that runs a crawl on a twisted reactor that runs (for the
+    lifetime of the process) in a background thread, and waits for it to finish.
+
+    This is what lets us crawl several times in the same process, though twisted's
+    reactor can't be restarted.
+    """
+    import crochet  # pip install crochet
+    from scrapy.crawler import CrawlerRunner
+    from scrapy.settings import Settings
+    from scrapy.utils.reactor import install_reactor, is_reactor_installed
+
+    if not is_reactor_installed():
+        # install the reactor scrapy wants, before crochet installs the default one
+        install_reactor(Settings().get('TWISTED_REACTOR'))
+    crochet.setup()
+
+    @crochet.run_in_reactor
+    def start_crawl(spidercls, settings: dict, spider_kwargs: dict, done: Future):
+        from twisted.internet import reactor
+
+        runner = CrawlerRunner(settings)
+        _configure_reactor(reactor, runner)
+        crawler = runner.create_crawler(spidercls)
+        crawling = runner.crawl(crawler, **spider_kwargs)
+        crawling.addCallbacks(
+            lambda _: done.set_result(crawler.spider.crawl_output),
+            lambda fail: done.set_exception(fail.value),
+        )
+        return crawler
+
+    @crochet.run_in_reactor
+    def stop_crawl(crawler):
+        return crawler.stop()
+
+    def crawl(
+        spidercls,
+        settings: dict,
+        spider_kwargs: dict,
+        *,
+        timeout: Optional[float] = DFLT_CRAWL_TIMEOUT,
+    ):
+        done = Future()
+        # Starting a crawl is quick: It's the crawl itself that may take long
+        crawler = start_crawl(spidercls, settings, spider_kwargs, done).wait(60)
+        try:
+            return done.result(timeout=timeout)
+        except FutureTimeoutError:
+            stop_crawl(crawler)  # so it doesn't go on writing files
+            raise RuntimeError(f"The crawl took more than {timeout} seconds")
+
+    return crawl
+
+
+def _serve_crawl_jobs(jobs: multiprocessing.Queue, results: multiprocessing.Queue):
+    """
+    Run the (job_id, pickled (spidercls, settings, spider_kwargs)) crawl jobs taken
+    from the jobs queue, concurrently, on the one twisted reactor of this (worker)
+    process, putting (job_id, loaded, error_message_or_None, crawl_output) in the
+    results queue as they finish (``loaded`` being False for the jobs that couldn't
+    even be unpickled), until a None job comes in.
+
+    A (job_id, None) job stops the crawl of job_id (which the caller gave up on).
+    """
+    from scrapy.crawler import CrawlerRunner
+    from scrapy.settings import Settings
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.reactor import install_reactor
+
+    install_reactor(Settings().get('TWISTED_REACTOR'))
+    from twisted.internet import reactor, threads
+
+    runners = {}  # one runner (and logging configuration) per distinct settings
+    crawlers = {}  # the crawlers of the running jobs, by job_id
+
+    def runner_for(settings: dict) -> CrawlerRunner:
+        key = repr(sorted(settings.items()))
+        if key not in runners:
+            configure_logging(settings)
+            runners[key] = CrawlerRunner(settings)
+            # The resolver is the reactor's, so the latest settings apply to all the
+            # crawls, which share its DNS cache. One pool thread is taken by jobs.get
+            _configure_reactor(reactor, runners[key], busy_threads=1)
+        return runners[key]
+
+    def get_next_job(_=None):
+        # the queue's get blocks, so it's done in a thread, off the reactor
+        getting = threads.deferToThread(jobs.get)
+        getting.addCallbacks(start_job, get_next_job)  # whatever happens, go on
+
+    def start_job(job):
+        if job is None:
+            reactor.stop()
+            return
+        # don't wait for this crawl to be done to get the next one
+        reactor.callLater(0, get_next_job)
+        job_id, pickled_job = job
+        if pickled_job is None:
+            if job_id in crawlers:
+                crawlers[job_id].stop()
+            return
+        try:
+            # Unpickled here, so that a job we can't unpickle (e.g. with a function
+            # of the parent's __main__) fails alone, instead of stopping the worker
+            spidercls, settings, spider_kwargs = pickle.loads(pickled_job)
+        except Exception as e:
+            results.put((job_id, False, repr(e), None))
+            return
+        try:
+            runner = runner_for(settings)
+            crawler = runner.create_crawler(spidercls)
+            crawling = runner.crawl(crawler, **spider_kwargs)
+        except Exception as e:
+            results.put((job_id, True, repr(e), None))
+            return
+        crawlers[job_id] = crawler
+
+        def forget_crawler(result):
+            del crawlers[job_id]
+            return result
+
+        crawling.addBoth(forget_crawler)
+        crawling.addCallbacks(
+            lambda _: results.put((job_id, True, None, crawler.spider.crawl_output)),
+            lambda fail: results.put((job_id, True, fail.getErrorMessage(), None)),
+        )
+
+    reactor.callWhenRunning(get_next_job)
+    reactor.run(installSignalHandlers=False)
+
+
+class _CrawlJobNotLoaded(RuntimeError):
+    """Raised when the crawl worker can't load (unpickle) a crawl job"""
+
+
+class _CrawlWorker:
+    """
+    A (lazily started, long-lived) process that runs the crawls it's sent, so that
+    each crawl doesn't have to pay for the start of a new process, scrapy imports,
+    and twisted reactor.
+
+    The worker is spawned, never forked: It's started from whichever thread crawls
+    first, and forking a process with several threads (e.g. those of
+    ``scrape_multiple_sites``) can deadlock on the locks the other threads held.
+    Since it's started only once, spawning it costs nothing per crawl.
+    """
+
+    def __init__(self):
+        ctx = multiprocessing.get_context('spawn')
+        self._jobs, self._results = ctx.Queue(), ctx.Queue()
+        self._process = ctx.Process(
+            target=_serve_crawl_jobs, args=(self._jobs, self._results), daemon=True
+        )
+        self._process.start()
+        # job_id -> Future of the (loaded, error message, crawl_output)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        threading.Thread(target=self._receive_results, daemon=True).start()
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def crawl(
+        self,
+        spidercls,
+        settings: dict,
+        spider_kwargs: dict,
+        *,
+        timeout: Optional[float] = DFLT_CRAWL_TIMEOUT,
+    ):
+        """Run a crawl in the worker, wait for it to be done, and return its output"""
+        job = pickle.dumps((spidercls, settings, spider_kwargs))
+        job_id, result = next(self._job_ids), Future()
+        with self._lock:
+            self._pending[job_id] = result
+        self._jobs.put((job_id, job))
+        try:
+            loaded, error, crawl_output = result.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._pending.pop(job_id, None)
+            self._jobs.put((job_id, None))  # stop it, so it doesn't go on writing files
+            raise RuntimeError(f"The crawl took more than {timeout} seconds")
+        if not loaded:
+            raise _CrawlJobNotLoaded(f"The crawl worker couldn't load it: {error}")
+        if error is not None:
+            raise RuntimeError(f"The crawl failed: {error}")
+        return crawl_output
+
+    def stop(self):
+        if self._process.is_alive():
+            self._jobs.put(None)
+            self._process.join(timeout=5)
+
+    def _receive_results(self):
+        while True:
+            try:
+                job_id, loaded, error, crawl_output = self._results.get(timeout=1)
+            except queue.Empty:
+                if self._process.is_alive():
+                    continue
+                error = "The crawl worker process died"
+                with self._lock:
+                    pending, self._pending = self._pending, {}
+                for result in pending.values():
+                    result.set_result((True, error, None))
+                return
+            with self._lock:
+                result = self._pending.pop(job_id, None)
+            if result is not None:  # None if the crawl was given up on (timeout)
+                result.set_result((loaded, error, crawl_output))
+
+
+_crawl_worker = None
+_crawl_worker_lock = threading.Lock()
+
+
+def _get_crawl_worker() -> _CrawlWorker:
+    """Get the crawl worker, (re)starting it if needed"""
+    global _crawl_worker
+    with _crawl_worker_lock:
+        if _crawl_worker is None or not _crawl_worker.is_alive():
+            _crawl_worker = _CrawlWorker()
+            atexit.register(_crawl_worker.stop)
+        return _crawl_worker
+
+
+def _can_be_pickled(obj) -> bool:
+    try:
+        pickle.dumps(obj)
+        return True
+    except Exception:  # pickling can fail with many kinds of errors
+        return False
+
+
+# A simple regex to check for common HTML tags
+_HTML_TAGS_PATTERN = (
+    r'<(html|head|body|title|meta|link|script|style|div|span|p|a|img|table|tr'
+    r'|td|ul|ol|li|h1|h2|h3|h4|h5|h6|br|hr|!--)'  # Opening tags
+)
+_HTML_TAGS_RE = re.compile(_HTML_TAGS_PATTERN, re.IGNORECASE)
+# The same, to search bytes directly (tag names are ascii, so no need to decode)
+_HTML_TAGS_RE_BYTES = re.compile(_HTML_TAGS_PATTERN.encode(), re.IGNORECASE)
+HTML_SNIFF_SIZE = 4096  # how many (leading) characters is_html_content looks at
+# What (lower cased) html documents usually start with (once whitespace is skipped)
+_HTML_STARTS = ('<!doctype html', '<html')
+_HTML_STARTS_BYTES = tuple(x.encode() for x in _HTML_STARTS)
+_STR_TO_SKIP = ' \t\r\n\f\ufeff'  # whitespace, and the byte order mark (BOM)
+_BYTES_TO_SKIP = _STR_TO_SKIP.encode()
+_HTML_HEAD_SIZE = 512  # how many (leading) characters we look for these starts in
 
 
 def is_html_content(content: Union[str, bytes]) -> bool:
     """
-    Check if the given content is HTML.
+    Check if the given content is HTML (looking for HTML tags in its first
+    ``HTML_SNIFF_SIZE`` characters).
 
     :param content: The content to check, either a string or bytes.
     :return: True if the content is HTML, otherwise False.
@@ -213,22 +929,310 @@ def is_html_content(content: Union[str, bytes]) -> bool:
     True
     >>> is_html_content(non_html_string)
     False
+    >>> is_html_content(html_string.encode())
+    True
+    >>> is_html_content(b'\\xef\\xbb\\xbf  <!DOCTYPE html>')
+    True
+
     """
+    # Only the beginning of the content is checked: HTML tags show up early
     if isinstance(content, bytes):
-        content = content.decode('utf-8', errors='ignore')
+        # Most html documents say so right away, so check that first (cheaply)
+        head = content[:_HTML_HEAD_SIZE].lstrip(_BYTES_TO_SKIP).lower()
+        if head.startswith(_HTML_STARTS_BYTES):
+            return True
+        match = _HTML_TAGS_RE_BYTES.search(content, 0, HTML_SNIFF_SIZE)
+    else:
+        head = content[:_HTML_HEAD_SIZE].lstrip(_STR_TO_SKIP).lower()
+        if head.startswith(_HTML_STARTS):
+            return True
+        match = _HTML_TAGS_RE.search(content, 0, HTML_SNIFF_SIZE)
+    return match is not None
 
-    # A simple regex to check for common HTML tags
-    html_tags = re.compile(
-        (
-            r'<(html|head|body|title|meta|link|script|style|div|span|p|a|img|table|tr'
-            r'|td|ul|ol|li|h1|h2|h3|h4|h5|h6|br|hr|!--)'  # Opening tags
-        ),
-        re.IGNORECASE,
+
+def _mk_html2text_converter(html2text_options: Mapping) -> html2text.HTML2Text:
+    """Make an html2text converter, configured with the given options.
+
+    Note: Converters are not cached across calls on purpose: They carry state from
+    one document to the next (e.g. the numbering of reference links), and resetting
+    that state costs more than making a new converter (a few microseconds, which is
+    negligible compared to the conversion itself).
+    A converter is (re)used for all the documents of a ``html_to_markdown`` call.
+    """
+    converter = html2text.HTML2Text()
+    for key, value in html2text_options.items():
+        setattr(converter, key, value)
+    return converter
+
+
+def _mk_html_converter(
+    converter: Union[str, Callable[[str], str]], html2text_options: Mapping
+) -> Callable[[str], str]:
+    """Make the (html str -> markdown str) function ``html_to_markdown`` will use"""
+    if converter == 'html2text':
+        return _mk_html2text_converter(html2text_options).handle
+    elif converter == 'lxml':
+        return lxml_html_to_markdown
+    elif callable(converter):
+        return converter
+    raise ValueError(
+        f"converter should be 'html2text', 'lxml' or a callable, not {converter!r}"
     )
 
-    if html_tags.search(content):
-        return True
-    return False
+
+def _html_to_md(convert: Callable[[str], str], html_content: Union[str, bytes]):
+    """Convert html_content to markdown, or return None if it can't be decoded"""
+    try:
+        if isinstance(html_content, bytes):
+            html_content = html_content.decode()
+        return convert(html_content)
+    except UnicodeDecodeError:
+        print(f"Failed to decode HTML content: {html_content[:30]=}")
+        # TODO: Give more control to the user to decide what to do in this case
+        # skip it
+        return None
+
+
+_worker_convert = None  # the html->markdown function of a conversion worker process
+
+
+def _init_html_to_md_worker(converter, html2text_options: Mapping):
+    global _worker_convert
+    _worker_convert = _mk_html_converter(converter, html2text_options)
+
+
+def _html_to_md_worker(html_content: Union[str, bytes]):
+    return _html_to_md(_worker_convert, html_content)
+
+
+# --------------------------------------------------------------------------------------
+# A (fast, but basic) html to markdown conversion, based on lxml's (C) html parser
+
+_MD_SKIPPED_TAGS = frozenset(
+    {'head', 'script', 'style', 'noscript', 'template', 'iframe', 'svg', 'button'}
+)
+_MD_HEADER_TAGS = {f'h{i}': '#' * i for i in range(1, 7)}
+_MD_LIST_TAGS = frozenset({'ul', 'ol'})
+_MD_BLOCK_TAGS = frozenset(
+    (
+        'address article aside blockquote body dd details div dl dt fieldset '
+        'figcaption figure footer form header hr html li main nav p pre section '
+        'summary table'
+    ).split()
+    + list(_MD_HEADER_TAGS)
+    + list(_MD_LIST_TAGS)
+)
+_MD_EMPHASIS = {'b': '**', 'strong': '**', 'i': '_', 'em': '_'}
+_WHITESPACES_RE = re.compile(r'\s+')
+
+
+def lxml_html_to_markdown(html_content: str) -> str:
+    """
+    Convert html to markdown by walking the (C-parsed) ``lxml`` tree of the html.
+
+    Much faster than ``html2text``, but more basic: Handles headers, paragraphs,
+    links, images, emphasis, code, lists, block quotes and (simple) tables.
+
+    >>> md = lxml_html_to_markdown(
+    ...     '<h1>Title</h1><p>Some <b>bold</b> and a <a href="/x">link</a>.</p>'
+    ...     '<ul><li>one</li><li>two<ol><li>three</li></ol></li></ul>'
+    ... )
+    >>> print(md, end='')
+    # Title
+    <BLANKLINE>
+    Some **bold** and a [link](/x).
+    <BLANKLINE>
+    * one
+    * two
+      1. three
+    <BLANKLINE>
+    >>> print(lxml_html_to_markdown(
+    ...     '<table><tr></tr><tr><th>a</th></tr><tr><td>1</td><td>2</td></tr></table>'
+    ... ), end='')
+    | a |  |
+    | --- | --- |
+    | 1 | 2 |
+    <BLANKLINE>
+    >>> print(lxml_html_to_markdown(
+    ...     '<h2>a<br>b</h2><ol><li>c<ul><li>d</li></ul></li></ol>'
+    ...     '<table><tr><td><table><tr><td>in</td></tr></table></td></tr></table>'
+    ... ), end='')
+    ## a b
+    <BLANKLINE>
+    1. c
+       * d
+    <BLANKLINE>
+    | in |
+    | --- |
+    <BLANKLINE>
+    >>> lxml_html_to_markdown('<!-- nothing here -->')
+    ''
+    """
+    import lxml.html  # pip install lxml (comes with scrapy)
+
+    if not html_content.strip():
+        return ''
+    # Parsing bytes, since lxml refuses str with an xml encoding declaration
+    parser = lxml.html.HTMLParser(encoding='utf-8')
+    try:
+        root = lxml.html.document_fromstring(html_content.encode(), parser=parser)
+    except lxml.etree.ParserError:  # "Document is empty" (e.g. only comments)
+        return ''
+    return ''.join(block + '\n\n' for block in _md_blocks(root))
+
+
+def _md_blocks(el) -> List[str]:
+    """The markdown blocks (paragraphs, headers, lists...) of the contents of el"""
+    blocks, inline = [], [_squash(el.text)]
+
+    def flush_inline():
+        if text := ''.join(inline).strip():
+            blocks.append(text)
+        inline.clear()
+
+    for child in el:
+        if child.tag in _MD_BLOCK_TAGS:
+            flush_inline()
+            blocks.extend(_md_block(child))
+        else:
+            inline.append(_md_inline(child))
+        inline.append(_squash(child.tail))
+    flush_inline()
+    return blocks
+
+
+def _md_block(el) -> List[str]:
+    tag = el.tag
+    if tag in _MD_HEADER_TAGS:
+        # a header is a single line, so line breaks become spaces
+        text = _md_inline_contents(el).strip().replace('\n', ' ')
+        return [f"{_MD_HEADER_TAGS[tag]} {text}"] if text else []
+    elif tag in _MD_LIST_TAGS:
+        return [_md_list(el)]
+    elif tag == 'pre':
+        return ['```\n' + el.text_content().strip('\n') + '\n```']
+    elif tag == 'hr':
+        return ['* * *']
+    elif tag == 'blockquote':
+        quoted = '\n\n'.join(_md_blocks(el)).split('\n')
+        return ['\n'.join(f'> {line}'.rstrip() for line in quoted)]
+    elif tag == 'table':
+        table = _md_table(el)
+        return [table] if table else []
+    else:
+        return _md_blocks(el)
+
+
+def _md_list(el) -> str:
+    items = []
+    for i, li in enumerate(el.iterchildren('li'), 1):
+        bullet = f'{i}. ' if el.tag == 'ol' else '* '
+        # The other lines of the item (e.g. those of nested lists) are indented by
+        # the width of the bullet, which is what makes them part of the item
+        text = '\n'.join(_md_blocks(li)).replace('\n', '\n' + ' ' * len(bullet))
+        items.append(bullet + text)
+    return '\n'.join(items)
+
+
+def _md_table(el) -> str:
+    rows = [
+        [
+            _md_inline_contents(cell).strip().replace('\n', ' ').replace('|', '\\|')
+            for cell in tr.iterchildren('th', 'td')
+        ]
+        # the table's own rows (not those of the tables nested in its cells)
+        for tr in el.xpath('./tr|./thead/tr|./tbody/tr|./tfoot/tr')
+    ]
+    rows = [row for row in rows if row]  # a row without cells has nothing to show
+    if not rows:
+        return ''
+    n_columns = max(map(len, rows))
+    lines = [
+        '| ' + ' | '.join(row + [''] * (n_columns - len(row))) + ' |' for row in rows
+    ]
+    # markdown tables need a separator line after the first (header) row
+    lines.insert(1, '|' + ' --- |' * n_columns)
+    return '\n'.join(lines)
+
+
+def _md_inline(el) -> str:
+    tag = el.tag
+    if not isinstance(tag, str) or tag in _MD_SKIPPED_TAGS:  # or comment, etc.
+        return ''
+    elif tag == 'a':
+        text = _md_inline_contents(el).strip()
+        href = el.get('href')
+        return f'[{text}]({href})' if href and text else text
+    elif tag == 'img':
+        src = el.get('src')
+        return f"![{el.get('alt', '')}]({src})" if src else ''
+    elif tag in _MD_EMPHASIS:
+        text = _md_inline_contents(el).strip()
+        return f'{_MD_EMPHASIS[tag]}{text}{_MD_EMPHASIS[tag]}' if text else ''
+    elif tag == 'code':
+        return f'`{el.text_content()}`'
+    elif tag == 'br':
+        return '\n'
+    else:
+        return _md_inline_contents(el)
+
+
+def _md_inline_contents(el) -> str:
+    return _squash(el.text) + ''.join(
+        _md_inline(child) + _squash(child.tail) for child in el
+    )
+
+
+def _squash(text: Optional[str]) -> str:
+    """Collapse whitespace (as html rendering does)"""
+    return _WHITESPACES_RE.sub(' ', text) if text else ''
+
+
+def _read_bytes(filepath: str, buffer_size: int = 64 * 1024) -> bytes:
+    with open(filepath, 'rb', buffering=buffer_size) as f:
+        return f.read()
+
+
+def _walk_files(rootdir: str) -> Iterator[str]:
+    """
+    Yield the paths of the files under rootdir, recursively (in the same order as
+    ``Path.rglob`` would).
+
+    Uses ``os.scandir``, whose entries know (in most cases, without an extra ``stat``)
+    whether they are files or directories. Symlinked directories are not followed.
+    """
+    stack = [rootdir]
+    while stack:
+        dirpath = stack.pop()
+        subdirs = []
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+        stack.extend(reversed(subdirs))  # so they're popped in listing order
+
+
+def _html_contents_of_str(htmls: str) -> Iterable[Union[str, bytes]]:
+    """The html contents a string stands for: An html file, a folder, or html itself"""
+    if htmls.endswith(".html"):
+        return [_read_bytes(htmls)]
+    # Note: os.path.isdir is just False (no error) for strings that can't be paths,
+    # like too long ones, or ones with null chars, so it can be asked of html too
+    elif os.path.isdir(htmls):
+        # TODO: Handle this better, and in such a way that directories can be
+        #   captured and produce their own markdown content, which will then
+        #   be combined with the rest of the markdown content.
+
+        # For now though:
+        # Recursively find all HTML files in the directory
+        return map(_read_bytes, _walk_files(htmls))
+    else:
+        return [htmls]
+
+
+DFLT_MARKDOWN_AGGREGATOR = "\n\n".join
 
 
 # TODO: Replace this by a version that uses dol.store_aggregate
@@ -237,8 +1241,10 @@ def html_to_markdown(
     save_filepath: Optional[str] = None,
     *,
     content_filt=is_html_content,
-    markdown_contents_aggregator: Callable = "\n\n".join,
+    markdown_contents_aggregator: Callable = DFLT_MARKDOWN_AGGREGATOR,
     prefixes=None,
+    max_workers: Optional[int] = 1,
+    converter: Union[str, Callable[[str], str]] = 'html2text',
     **html2text_options,
 ):
     """
@@ -255,6 +1261,13 @@ def html_to_markdown(
     :param markdown_contents_aggregator: A function to aggregate the Markdown strings.
     :param prefixes: A list of prefixes to be woven with to each Markdown string
         (there must be the same number of prefixes as HTML files).
+    :param max_workers: The number of processes to convert the HTML contents with.
+        If 1 (the default), the conversion is done in the current process. If None,
+        as many processes as there are CPUs are used. Worth it when converting many
+        (or large) HTML contents, since html2text is pure (CPU-bound) python.
+    :param converter: How to convert (decoded) html to markdown: 'html2text' (the
+        default), 'lxml' (for ``lxml_html_to_markdown``: much faster, but more basic),
+        or a callable (that can be pickled, if max_workers isn't 1).
     :param html2text_options: Options to pass to the html2text.HTML2Text()
         converter.
     :return: Combined Markdown string if save_filepath is None, otherwise returns the
@@ -266,59 +1279,51 @@ def html_to_markdown(
         and `markdown_contents_aggregator=list`.
     """
 
-    def read_html_file(filepath):
-        return Path(filepath).read_bytes()
-
     if isinstance(htmls, Mapping):
         html_contents = filter(content_filt, htmls.values())
+    elif isinstance(htmls, str):
+        html_contents = _html_contents_of_str(htmls)
+    elif isinstance(htmls, Iterable):
+        html_contents = filter(content_filt, map(_read_bytes, htmls))
     else:
-        if isinstance(htmls, str):
-            if htmls.endswith(".html"):
-                html_contents = [read_html_file(htmls)]
-            elif len(htmls) < 1000 and Path(htmls).is_dir():
-                # TODO: Handle this better, and in such a way that directories can be
-                #   captured and produce their own markdown content, which will then
-                #   be combined with the rest of the markdown content.
-
-                # For now though:
-                # Recursively find all HTML files in the directory
-                html_contents = map(
-                    read_html_file, filter(Path.is_file, Path(htmls).rglob("*"))
+        raise TypeError(
+            f"htmls must be an iterable of file paths or a mapping, not {htmls}"
+        )
+
+    with ExitStack() as stack:
+        # Convert HTML contents to Markdown (lazily)
+        if max_workers == 1:
+            # Initialize the (html2text, by default) converter with options
+            convert = _mk_html_converter(converter, html2text_options)
+            markdown_contents = map(partial(_html_to_md, convert), html_contents)
+        else:
+            # Each worker process makes its own converter (once)
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers,
+                    initializer=_init_html_to_md_worker,
+                    initargs=(converter, html2text_options),
                 )
-            else:
-                html_contents = [htmls]
-        if not isinstance(htmls, Iterable):
-            raise TypeError(
-                f"htmls must be an iterable of file paths or a mapping, not {htmls}"
             )
-        # html_contents = map(read_html_file, htmls)
+            markdown_contents = executor.map(
+                _html_to_md_worker, html_contents, chunksize=8
+            )
+        markdown_contents = (md for md in markdown_contents if md is not None)
 
-    # Initialize the html2text converter with options
-    converter = html2text.HTML2Text()
-    for key, value in html2text_options.items():
-        setattr(converter, key, value)
+        if prefixes:
+            markdown_contents = (
+                f"{prefix}\n{markdown}"
+                for prefix, markdown in zip(prefixes, markdown_contents)
+            )
 
-    # Convert HTML contents to Markdown
-    def _markdown_contents(html_contents):
-        for html_content in html_contents:
-            try:
-                if isinstance(html_content, bytes):
-                    html_content = html_content.decode()
-                yield converter.handle(html_content)
-            except UnicodeDecodeError:
-                print(f"Failed to decode HTML content: {html_content[:30]=}")
-                # TODO: Give more control to the user to decide what to do in this case
-                # skip it
-                pass
-
-    markdown_contents = list(_markdown_contents(html_contents))
-
-    if prefixes:
-        markdown_contents = (
-            f"{prefix}\n{markdown}"
-            for prefix, markdown in zip(prefixes, markdown_contents)
-        )
-    combined_markdown = markdown_contents_aggregator(markdown_contents)
+        if save_filepath and markdown_contents_aggregator is DFLT_MARKDOWN_AGGREGATOR:
+            # No need to hold the combined markdown in memory: Stream it to the file
+            _write_joined(
+                Path(save_filepath).expanduser().absolute(), markdown_contents
+            )
+            return save_filepath
+
+        combined_markdown = markdown_contents_aggregator(markdown_contents)
 
     if save_filepath:
         Path(save_filepath).expanduser().absolute().write_text(combined_markdown)
@@ -327,6 +1332,17 @@ def html_to_markdown(
         return combined_markdown
 
 
+def _write_joined(
+    filepath, strings: Iterable[str], sep: str = "\n\n", buffer_size: int = 1 << 20
+):
+    """Write ``sep.join(strings)`` to filepath, without making the joined string"""
+    with open(filepath, 'w', buffering=buffer_size) as f:
+        for i, string in enumerate(strings):
+            if i:
+                f.write(sep)
+            f.write(string)
+
+
 # TODO: Return object that can be used to (a) know where the data is being saved,
 #  and (b) status on progress
 def download_site(
@@ -334,10 +1350,14 @@ def download_site(
     url_to_filepath: Optional[Union[str, Callable[[str], str]]] = url_to_localpath,
     *,
     depth: int = 1,
-    filter_urls: Optional[Callable[[str], bool]] = None,
+    filter_urls: Optional[Union[str, re.Pattern, Callable[[str], bool]]] = None,
     mk_missing_dirs: bool = True,
     verbosity: int = 0,
     rootdir: str = DFLT_ROOTDIR,
+    in_process: bool = False,
+    reuse_worker: bool = False,
+    crawler_settings: Optional[dict] = None,
+    timeout: Optional[float] = DFLT_CRAWL_TIMEOUT,
     **extra_kwargs,
 ):
     """
@@ -346,40 +1366,59 @@ def download_site(
     :param start_url: The URL to start downloading from.
     :param url_to_filepath: The function to convert URLs to local filepaths.
     :param depth: The maximum depth to follow links.
-    :param filter_urls: A function to filter URLs to download.
+    :param filter_urls: A function to filter URLs to download (or a regex that the
+        URLs to download must match).
     :param mk_missing_dirs: Whether to create missing directories.
     :param verbosity: The verbosity level.
     :param rootdir: The root directory to save the downloaded files.
+    :param crawler_settings: Scrapy settings to use for the crawl, on top of (and
+        overriding) ``DFLT_CRAWLER_SETTINGS``, e.g. ``{'CONCURRENT_REQUESTS': 64}``.
+    :param in_process: If True, crawl in the current process, on a twisted reactor
+        that is started once (with ``crochet``) and reused by later calls, instead of
+        paying for a new process for each call. Note that this installs (and keeps)
+        a running reactor in the current process.
+    :param reuse_worker: If True (and not ``in_process``), the crawl is run by a
+        worker process that is started with the first crawl, and reused by the next
+        ones (concurrent calls are crawled concurrently). Crawls whose arguments
+        can't be pickled (e.g. lambda ``filter_urls``) still get a process of their
+        own, as all crawls do by default. The worker is spawned, so a script that
+        uses it must guard its top level code with ``if __name__ == '__main__':``.
+    :param timeout: The maximum number of seconds to wait for the crawl. If it takes
+        longer, it's stopped, and a ``RuntimeError`` is raised. If None (the default),
+        there's no limit.
     :param extra_kwargs: Extra keyword arguments to pass to the Scrapy spider.
 
     """
 
-    _crawl = partial(
-        _download_site,
-        url,
-        url_to_filepath,
-        depth=depth,
-        filter_urls=filter_urls,
-        mk_missing_dirs=mk_missing_dirs,
-        verbosity=verbosity,
-        rootdir=rootdir,
-        **extra_kwargs,
+    _crawl(
+        RecursiveDownloader,
+        _crawler_settings(verbosity, crawler_settings),
+        dict(
+            start_url=url,
+            url_to_filepath=url_to_filepath,
+            depth=depth,
+            filter_urls=filter_urls,
+            mk_missing_dirs=mk_missing_dirs,
+            verbosity=verbosity,
+            rootdir=rootdir,
+            **extra_kwargs,
+        ),
+        in_process=in_process,
+        reuse_worker=reuse_worker,
+        timeout=timeout,
     )
 
-    p = multiprocessing.Process(target=_crawl)
-    p.start()
-    p.join()
-
 
 def markdown_of_site(
     url: str,
     *,
     depth: int = 1,
-    filter_urls: Optional[Callable[[str], bool]] = None,
+    filter_urls: Optional[Union[str, re.Pattern, Callable[[str], bool]]] = None,
     save_filepath: Optional[str] = None,
     deduplicate_lines_min_block_size: Optional[int] = None,
     verbosity: int = 0,
     dir_to_save_page_slurps: str = None,
+    timeout: Optional[float] = DFLT_CRAWL_TIMEOUT,
     **extra_kwargs,
 ):
     """
@@ -393,12 +1432,19 @@ def markdown_of_site(
     Args:
     - url: The URL of the site to download.
     - depth: The maximum depth to follow links.
-    - filter_urls: A function to filter URLs to download.
+    - filter_urls: A function to filter URLs to download (or a regex that the URLs
+        to download must match).
     - save_filepath: The file path where the combined Markdown will be saved.
     - deduplicate_lines_min_block_size: The minimum block size to deduplicate lines.
     - verbosity: The verbosity level.
-    - dir_to_save_page_slurps: The directory to save the downloaded pages.
-    - extra_kwargs: Extra keyword arguments to pass to the Scrapy spider.
+    - dir_to_save_page_slurps: The directory to save the downloaded pages. If not
+        given, the pages aren't saved: They're converted to markdown as they're
+        downloaded (see ``MarkdownSpider``).
+    - timeout: The maximum number of seconds to wait for the crawl (see
+        ``download_site``). If None (the default), there's no limit.
+    - extra_kwargs: Extra keyword arguments for the crawl (see ``download_site``).
+        In the no ``dir_to_save_page_slurps`` case, these can also include the
+        ``converter`` and ``html2text_options`` of the conversion.
 
     Returns:
     - The Markdown string of the site (if save_filepath is None), otherwise the save_filepath.
@@ -439,32 +1485,44 @@ def markdown_of_site(
                     f"Directory (needed to save Markdown) not found: {containing_dir}"
                 )
 
-    # make a temporary directory, ensuring it is empty
-    # TODO: Wasteful to make a tmpdir if dir_to_save_page_slurps is given. Instead,
-    #   would be nice to use a placeholder context manager that does nothing if the
-    #   directory is given.
-    if not dir_to_save_page_slurps:
-        dir_to_save_page_slurps = TemporaryDirectory(prefix='scraped_').name
-    else:
+    if dir_to_save_page_slurps:
         assert os.path.isdir(
             dir_to_save_page_slurps
         ), f"dir_to_save_page_slurps must be a directory: {dir_to_save_page_slurps}"
 
-    # download the site to the temporary directory
-    _url_to_localpath = partial(url_to_localpath, rootdir=dir_to_save_page_slurps)
-
-    download_site(
-        url,
-        url_to_filepath=_url_to_localpath,
-        depth=depth,
-        filter_urls=filter_urls,
-        verbosity=verbosity,
-        rootdir=dir_to_save_page_slurps,
-        **extra_kwargs,
-    )
+        # download the site to the directory
+        _url_to_localpath = partial(url_to_localpath, rootdir=dir_to_save_page_slurps)
+
+        download_site(
+            url,
+            url_to_filepath=_url_to_localpath,
+            depth=depth,
+            filter_urls=filter_urls,
+            verbosity=verbosity,
+            rootdir=dir_to_save_page_slurps,
+            timeout=timeout,
+            **extra_kwargs,
+        )
 
-    # convert the site to markdown
-    markdown = html_to_markdown(dir_to_save_page_slurps, save_filepath=save_filepath)
+        # convert the (html) files of the site to markdown, as MarkdownSpider does
+        markdown = html_to_markdown(
+            _walk_files(dir_to_save_page_slurps), save_filepath=save_filepath
+        )
+    else:
+        # No need to save the pages: Convert them to markdown as they're downloaded
+        markdowns = _markdowns_of_site(
+            url,
+            depth=depth,
+            filter_urls=filter_urls,
+            verbosity=verbosity,
+            timeout=timeout,
+            **extra_kwargs,
+        )
+        if save_filepath:
+            _write_joined(Path(save_filepath).expanduser().absolute(), markdowns)
+            markdown = save_filepath
+        else:
+            markdown = DFLT_MARKDOWN_AGGREGATOR(markdowns)
 
     if deduplicate_lines_min_block_size:
         markdown, _ = deduplicate_lines(
@@ -474,6 +1532,38 @@ def markdown_of_site(
     return markdown
 
 
+def _markdowns_of_site(
+    url: str,
+    *,
+    depth: int = 1,
+    filter_urls: Optional[Union[str, re.Pattern, Callable[[str], bool]]] = None,
+    verbosity: int = 0,
+    in_process: bool = False,
+    reuse_worker: bool = False,
+    crawler_settings: Optional[dict] = None,
+    timeout: Optional[float] = DFLT_CRAWL_TIMEOUT,
+    **extra_kwargs,
+) -> List[str]:
+    """The markdowns of the pages of a site (crawled as ``download_site`` does)"""
+    markdowns = _crawl(
+        MarkdownSpider,
+        _crawler_settings(verbosity, crawler_settings),
+        dict(
+            start_url=url,
+            depth=depth,
+            filter_urls=filter_urls,
+            verbosity=verbosity,
+            **extra_kwargs,
+        ),
+        in_process=in_process,
+        reuse_worker=reuse_worker,
+        timeout=timeout,
+    )
+    if markdowns is None:  # the spider didn't get to give its markdowns
+        raise RuntimeError(f"The crawl of {url} failed (see the logs for why)")
+    return markdowns
+
+
 def deduplicate_lines(
     text: str, min_block_size: int = 5, key: Optional[Callable] = hash
 ) -> Tuple[str, List[Dict]]:
@@ -494,12 +1584,52 @@ def deduplicate_lines(
 
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import mimetypes
+import shutil
+from contextlib import suppress
+from email.utils import formatdate
 from urllib.parse import unquote
 
 # from graze.base import url_to_localpath
 
+DFLT_USER_AGENT = 'scraped (https://github.com/thorwhalen/scraped)'
+DFLT_REQUEST_TIMEOUT = (5, 30)  # (connect, read) timeouts, in seconds
+DFLT_DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # so large files are written in few syscalls
+
+
+def _mk_session(
+    *,
+    pool_connections: int = 32,
+    pool_maxsize: int = 64,
+    max_retries: Retry = Retry(
+        total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]
+    ),
+    user_agent: str = DFLT_USER_AGENT,
+) -> requests.Session:
+    """Make a requests session that keeps connections alive and pooled, so that
+    repeated requests to the same host don't pay the TCP+TLS handshake every time"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=max_retries,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = user_agent
+    return session
+
+
+_SESSION = _mk_session()
+
+
+_CONTENT_DISPOSITION_FILENAME_RE = re.compile(
+    r'(?:^|;)\s*filename\s*=\s*(?:"([^"]*)"|([^;]*))', re.IGNORECASE
+)
+
 
 # This function is not used in the current implementation of the package,
 # but is provided here in case it is needed in the future.
@@ -514,15 +1644,21 @@ def _filename_from_content_disposition(content_disposition):
     :type content_disposition: str
     :return: The extracted filename or None if not found.
     :rtype: str or None
+
+    >>> _filename_from_content_disposition('attachment; filename="my%20file.pdf"')
+    'my file.pdf'
+    >>> _filename_from_content_disposition('inline; filename=data.csv; size=42')
+    'data.csv'
+    >>> _filename_from_content_disposition('inline') is None
+    True
     """
     if not content_disposition:
         return None
-    parts = content_disposition.split(';')
-    for part in parts:
-        if part.strip().startswith('filename='):
-            filename = part.split('=')[1].strip('"')
-            return unquote(filename)  # Decode percent-encoded filename
-    return None
+    match = _CONTENT_DISPOSITION_FILENAME_RE.search(content_disposition)
+    if match is None:
+        return None
+    filename = match.group(1) if match.group(1) is not None else match.group(2)
+    return unquote(filename.strip())  # Decode percent-encoded filename
 
 
 def _extension_from_mime(mime_type, custom_mime_map=None):
@@ -536,11 +1672,15 @@ def _extension_from_mime(mime_type, custom_mime_map=None):
     :return: The file extension for the given MIME type, or an empty string if not found.
     :rtype: str
     """
-    custom_mime_map = custom_mime_map or {}
-    if mime_type in custom_mime_map:
+    if custom_mime_map and mime_type in custom_mime_map:
         return custom_mime_map[mime_type]
-    extension = mimetypes.guess_extension(mime_type)
-    return extension if extension else ""
+    return _guess_extension(mime_type)
+
+
+@lru_cache(maxsize=256)
+def _guess_extension(mime_type: str) -> str:
+    """Memoized ``mimetypes.guess_extension`` (with "" instead of None)"""
+    return mimetypes.guess_extension(mime_type) or ""
 
 
 def _extension_from_response(response, *, custom_mime_map=None):
@@ -577,6 +1717,9 @@ def download_file(
     extension_cast: Optional[Callable] = _dflt_extension_cast,
     custom_mime_map=None,
     content_attribute='content',  # change to 'body' for scrapy
+    session: Optional[requests.Session] = None,
+    only_if_modified: bool = False,
+    overwrite: bool = True,
 ):
     """
     Download a file from the given URL and save it to the specified directory with the correct extension.
@@ -588,33 +1731,64 @@ def download_file(
     :type save_directory: str
     :param custom_mime_map: A dictionary mapping MIME types to file extensions. Defaults to None.
     :type custom_mime_map: dict, optional
+    :param session: The requests session to download with (to use your own
+        connection pool, headers, auth...). Defaults to a module-level session.
+    :type session: requests.Session, optional
+    :param only_if_modified: If True, and the file was already downloaded, ask the
+        server for it only if it was modified since (``If-Modified-Since``), leaving
+        the file as is if it wasn't.
+    :type only_if_modified: bool
+    :param overwrite: If False, and the file was already downloaded, don't download
+        it again (not even ask the server about it).
+    :type overwrite: bool
+    :return: The path of the (downloaded) file.
     :raises Exception: If the file could not be downloaded successfully.
 
     The reason to cast the extension is to allow for the possibility of making
     the extension so that we recognize if it comes from the url or from the
     content-type.
     """
-    response = requests.get(url)
-    __extension_from_response = partial(
-        _extension_from_response, custom_mime_map=custom_mime_map
+    filename = url_to_filename(url)
+    # Full path to save the file
+    save_path = os.path.join(save_directory, filename)
+
+    if not overwrite and os.path.exists(save_path):
+        return save_path
+
+    headers = {}
+    if only_if_modified:
+        with suppress(FileNotFoundError):
+            mtime = os.stat(save_path).st_mtime
+            headers['If-Modified-Since'] = formatdate(mtime, usegmt=True)
+
+    session = session or _SESSION
+    response = session.get(
+        url, stream=True, timeout=DFLT_REQUEST_TIMEOUT, headers=headers
     )
-    if response.status_code == 200:
-        filename = url_to_filename(url)
-        extension = __extension_from_response(response)
-        if extension_cast:
-            extension = extension_cast(extension)
-
-        # Ensure the save directory exists
-        os.makedirs(save_directory, exist_ok=True)
-
-        # Full path to save the file
-        save_path = os.path.join(save_directory, filename)
-
-        # Save the content to file
-        content_bytes = getattr(response, content_attribute)
-        with open(save_path, 'wb') as file:
-            file.write(content_bytes)
-    else:
-        raise Exception(
-            f"Failed to download the file. Status code: {response.status_code}"
-        )
+    with response:  # releases the connection back to the pool when done
+        if response.status_code == 304:  # not modified: the file we have is current
+            return save_path
+        elif response.status_code == 200:
+            extension = _extension_from_response(
+                response, custom_mime_map=custom_mime_map
+            )
+            if extension_cast:
+                extension = extension_cast(extension)
+
+            # Ensure the save directory exists
+            os.makedirs(save_directory, exist_ok=True)
+
+            # Save the content to file
+            with open(save_path, 'wb') as file:
+                if content_attribute == 'content':
+                    # copy the (decompressed) raw stream to the file, chunk by chunk,
+                    # instead of holding all of the content in memory
+                    response.raw.decode_content = True
+                    shutil.copyfileobj(response.raw, file, DFLT_DOWNLOAD_CHUNK_SIZE)
+                else:  # the response holds its content in some other attribute
+                    file.write(getattr(response, content_attribute))
+        else:
+            raise Exception(
+                f"Failed to download the file. Status code: {response.status_code}"
+            )
+    return save_path